@@ -0,0 +1,124 @@
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+def ImportTime(modules,path,cache,repeat=20):
+    """Median seconds to import the modules, in a fresh interpreter
+    with path first on sys.path and bytecode cached under cache
+    as it would be normally, after one run to warm the cache"""
+    code = f"""import sys, time
+sys.path.insert(0, {path!r})
+start = time.perf_counter()
+import {", ".join(modules)}
+print(time.perf_counter() - start)"""
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=cache)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    times = []
+    for _ in range(repeat+1):
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, env=env,
+            check=True, cwd=path,
+        )
+        times.append(float(result.stdout))
+    return statistics.median(times[1:])
+
+def StartupTime(path,cache,repeat=20):
+    """Median seconds from starting MailMiner.py in path, as it is run
+    normally, to its first attempt to reach the network to log in.
+    Stopping there leaves out the time the server takes to answer
+    while keeping everything MailMiner.py does to get that far.
+    Returns the error instead if it never gets that far"""
+    code = f"""import os, runpy, sys, time
+start = time.perf_counter()
+def connecting(event, args):
+    if event in ("socket.getaddrinfo", "socket.connect"):
+        print(time.perf_counter() - start, flush=True)
+        os._exit(0)
+sys.addaudithook(connecting)
+sys.argv = ["MailMiner.py"]
+runpy.run_path("MailMiner.py", run_name="__main__")"""
+    env = dict(os.environ, PYTHONPYCACHEPREFIX=cache)
+    env.pop("PYTHONDONTWRITEBYTECODE", None)
+    times = []
+    for _ in range(repeat+1):
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, env=env,
+            cwd=path,
+        )
+        try:
+            times.append(float(result.stdout.splitlines()[-1]))
+        except (IndexError, ValueError):
+            return (result.stderr.strip().splitlines() or ["exited before logging in"])[-1]
+    return statistics.median(times[1:])
+
+def Checkout(revision,path):
+    """Writes the python and config files from a git revision into path"""
+    files = subprocess.run(
+        ["git", "ls-tree", "--name-only", revision],
+        capture_output=True, text=True, check=True,
+    ).stdout.split()
+    for file in files:
+        if file.endswith((".py", ".cfg")):
+            with open(os.path.join(path, file), "wb") as out:
+                out.write(subprocess.run(
+                    ["git", "show", f"{revision}:{file}"],
+                    capture_output=True, check=True,
+                ).stdout)
+
+def ConvertNumTime(rows,repeat=5,number=200):
+    """Best seconds to convert every cell of the rows with
+    ConvertNum one at a time, and with ConvertNums a row at a time"""
+    import timeit
+    from Converters import ConvertNum, ConvertNums
+    single = min(timeit.repeat(
+        lambda: [[ConvertNum(cell) for cell in row] for row in rows],
+        repeat=repeat, number=number,
+    ))
+    batch = min(timeit.repeat(
+        lambda: [ConvertNums(row) for row in rows],
+        repeat=repeat, number=number,
+    ))
+    return single, batch
+
+if __name__ == "__main__":
+    # Compare against the given revision, or the first commit
+    revision = sys.argv[1] if len(sys.argv) > 1 else subprocess.run(
+        ["git", "rev-list", "--max-parents=0", "HEAD"],
+        capture_output=True, text=True, check=True,
+    ).stdout.split()[0]
+    print(f"Import times, {revision[:7]} against the working tree")
+    with tempfile.TemporaryDirectory() as baselinepath, tempfile.TemporaryDirectory() as cache:
+        Checkout(revision, baselinepath)
+        currentpath = os.getcwd()
+        for name, modules in (
+            ("import MailMiner", ["MailMiner"]),
+            ("import Converters", ["Converters"]),
+            # MailMiner has already imported re, which is most of what csv costs
+            ("import MailMiner, Converters", ["MailMiner", "Converters"]),
+        ):
+            before = ImportTime(modules, baselinepath, cache)
+            after = ImportTime(modules, currentpath, cache)
+            print(f"{name}: {before*1000:.1f} ms before, {after*1000:.1f} ms now, {(after-before)*1000:+.1f} ms")
+        # The goal was for MailMiner.py to get to logging in sooner
+        before = StartupTime(baselinepath, cache)
+        after = StartupTime(currentpath, cache)
+        if isinstance(before, str) or isinstance(after, str):
+            print("Startup to logging in could not be measured, so the goal of a faster startup is unconfirmed")
+            print(f"Before: {before}\nNow: {after}")
+        else:
+            print(f"Startup to logging in: {before*1000:.1f} ms before, {after*1000:.1f} ms now, {(after-before)*1000:+.1f} ms")
+            # Less than 5% is within the noise between runs
+            if after > before * 0.95:
+                print("The goal of a faster startup was not met")
+            else:
+                print("The goal of a faster startup was met")
+    # Sample Meter Online HH data, and the same with some blanks
+    from Converters import SplitLines
+    with open("Sample Inputs/Meter Online/Daily-HH-Rdgs 11-Jan-25.csv", "rb") as file:
+        rows = [line[4:] for line in SplitLines(file.read())]
+    blanks = [row[:-4] + ["", " ", "", ""] for row in rows]
+    for name, sample in (("HH rows", rows), ("HH rows with blanks", blanks)):
+        single, batch = ConvertNumTime(sample * 25)
+        print(f"{name}: ConvertNum {single*1000:.1f} ms, ConvertNums {batch*1000:.1f} ms, {single/batch:.1f}x")
@@ -1,3 +1,12 @@
+import csv
+import io
+import os
+import re
+from datetime import datetime, timedelta
+
+# Precompile regex to capture text before line ends, shared by all converters
+regexsplitlines = re.compile(b'^(.+?)(?:\r\n|\r|\n|$)+', flags=re.MULTILINE)
+
 def ConvertNum(string):
     """Converts strings to integers preferentially,
     unless it must be represented by a float,
@@ -16,17 +25,258 @@ def ConvertNum(string):
         # If its not a string, it's probably already converted
         return string
 
+def ConvertNums(fields):
+    """Converts a whole row or column of fields the same way as
+    ConvertNum, but in one pass and without exceptions for blanks.
+    Returns a list with integers preferentially, floats where needed
+    and None for anything blank or not a valid number.
+    Anything which isn't str or bytes is passed through unchanged"""
+    if not isinstance(fields, (list, tuple)):
+        fields = list(fields)
+    types = set(map(type, fields))
+    if not types <= {str, bytes}:
+        # If its not a string, it's probably already converted
+        return [
+            ConvertNums((field,))[0] if isinstance(field, (str, bytes)) else field
+            for field in fields
+        ]
+    # Fast path when every field is a number, float() ignores whitespace.
+    # Blanks, which may be just whitespace, are looked for first so they
+    # go straight to the slow path rather than raising in the fast one
+    if len(types) == 1 and all(map(str.strip if str in types else bytes.strip, fields)):
+        try:
+            floats = list(map(float, fields))
+        except ValueError:
+            # Something doesn't look like a number
+            pass
+        else:
+            return [int(f) if f.is_integer() else f if f == f else None for f in floats]
+    result = []
+    append = result.append
+    for field in fields:
+        if not field or field.isspace():
+            append(None)
+            continue
+        try:
+            f = float(field)
+        except ValueError:
+            append(None)
+            continue
+        append(int(f) if f.is_integer() else f if f == f else None)
+    return result
+
+def SplitLines(bytedata):
+    """Take the raw file which is just bytes,
+    chop it into lines and feed that into csv module.
+    regex finditer is more memory efficient than str.splitlines()
+    which does not scale to large file sizes."""
+    return csv.reader(
+        m.group(1).decode() for m in regexsplitlines.finditer(bytedata)
+    )
+
+def TruncatePartialLine(path):
+    """Removes anything after the last line end of a file,
+    such as half a row flushed by a run which died writing it,
+    so whatever is appended next starts on a line of its own"""
+    try:
+        with open(path, "rb+") as file:
+            size = end = file.seek(0, os.SEEK_END)
+            # Work backwards a block at a time to find the last line end
+            while end > 0:
+                start = max(0, end - 4096)
+                file.seek(start)
+                newline = file.read(end - start).rfind(b"\n")
+                if newline != -1:
+                    end = start + newline + 1
+                    break
+                end = start
+            if end < size:
+                print(f"Removing {size - end} bytes of a partial line from '{path}'")
+                file.truncate(end)
+    except FileNotFoundError:
+        pass
+    return None
+
+class Journal:
+    """Records which attachments have been fully written to the
+    outfiles and how big each outfile was at that point, so that a run
+    which died part way can roll back partial output and carry on from
+    where it stopped. Each commit is a json line appended to the file.
+    Files which are rewritten rather than appended to, are written under
+    a staging name and only swapped in once the commit naming them is
+    recorded, so they always match the rest of the output.
+    Converters which only write once they have read everything can
+    checkpoint each file's parsed data instead, which is kept pending
+    until the next commit so the file needn't be downloaded again.
+
+    With no path nothing is recorded and nothing is skipped"""
+    def __init__(self, path=None):
+        self.path = path
+        self.done = set()
+        self.sizes = {}
+        self.swapped = {}
+        self.pending = {}
+        if path:
+            # Only needed when there is a journal
+            import json
+            # A crash mid commit leaves the last line torn, remove it
+            # so the next entry isn't appended onto the end of it
+            TruncatePartialLine(path)
+            try:
+                with open(path) as journal:
+                    for line in journal:
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            print(f"Skipping unreadable entry in journal '{path}'")
+                            continue
+                        if "parsed" in entry:
+                            self.pending[tuple(entry["parsed"])] = entry["data"]
+                            continue
+                        for key in entry["files"]:
+                            self.done.add(tuple(key))
+                            self.pending.pop(tuple(key), None)
+                        self.sizes.update(entry["sizes"])
+                        self.swapped.update(entry.get("swapped", {}))
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def Key(file):
+        """Folder, UIDVALIDITY, email uid and part, or just the filename if
+        not from an email. UIDs are only permanent for one UIDVALIDITY, so
+        entries from before a folder was renumbered no longer match"""
+        return (
+            file.get(b"folder"),
+            file.get(b"uidvalidity"),
+            file.get(b"uid"),
+            file.get(b"part") or file[b"filename"],
+        )
+
+    def __contains__(self, file):
+        key = self.Key(file)
+        return key in self.done or key in self.pending
+
+    def Checkpoint(self, file, data):
+        """Records the parsed data for a file, which must be something
+        json can store, so it is in pending if the run dies before the
+        next commit"""
+        if not self.path:
+            return None
+        key = self.Key(file)
+        self.Write({"parsed": key, "data": data})
+        self.pending[key] = data
+        return None
+
+    def Staging(self, swapfile):
+        """Name to write a new version of swapfile under until Commit,
+        each one different so an old one can't be mistaken for it"""
+        if not self.path:
+            return swapfile + ".tmp"
+        return f"{swapfile}.{os.urandom(4).hex()}.tmp"
+
+    def Recover(self, *outfiles, swapfiles=()):
+        """Truncates outfiles back to their size at the last commit,
+        or records their current size if they've not been seen before.
+        Finishes swapping in any staged version of swapfiles which was
+        committed, and removes any which weren't"""
+        if not self.path:
+            return None
+        # Like json, only needed when there is a journal
+        import glob
+        for swapfile in swapfiles:
+            for staged in glob.glob(glob.escape(swapfile) + ".*.tmp"):
+                if self.swapped.get(swapfile) == staged:
+                    print(f"Finishing swapping in committed '{staged}'")
+                    os.replace(staged, swapfile)
+                else:
+                    print(f"Removing uncommitted '{staged}'")
+                    os.remove(staged)
+        new = {}
+        for outfile in outfiles:
+            try:
+                size = os.path.getsize(outfile)
+            except FileNotFoundError:
+                size = 0
+            if outfile not in self.sizes:
+                new[outfile] = size
+            elif size > self.sizes[outfile]:
+                print(f"Rolling back {size - self.sizes[outfile]} uncommitted bytes from '{outfile}'")
+                os.truncate(outfile, self.sizes[outfile])
+        if new:
+            self.Write({"files": [], "sizes": new})
+            self.sizes.update(new)
+        return None
+
+    def Commit(self, files, *outputs, swap=None):
+        """Makes sure everything written to the outputs is on disk
+        and then records the files, and any pending ones, as done.
+        Outputs can be open files or the paths of closed ones.
+        swap maps staging names from Staging to the files they replace,
+        which are swapped in once the commit is recorded"""
+        swap = swap or {}
+        if not self.path:
+            # Nothing to record, so no need to wait for the disk either
+            for staged, swapfile in swap.items():
+                os.replace(staged, swapfile)
+            return None
+        sizes = {}
+        for output in outputs:
+            if isinstance(output, str):
+                with open(output, "rb+") as closed:
+                    os.fsync(closed.fileno())
+                sizes[output] = os.path.getsize(output)
+                continue
+            output.flush()
+            os.fsync(output.fileno())
+            sizes[output.name] = os.fstat(output.fileno()).st_size
+        for staged in swap:
+            with open(staged, "rb+") as closed:
+                os.fsync(closed.fileno())
+        # Converters which checkpoint always write out what is pending
+        keys = [self.Key(file) for file in files] + list(self.pending)
+        swapped = {swapfile:staged for staged,swapfile in swap.items()}
+        self.Write({"files": keys, "sizes": sizes, "swapped": swapped})
+        self.done.update(keys)
+        self.sizes.update(sizes)
+        self.swapped.update(swapped)
+        self.pending.clear()
+        # Only now it is recorded can the staged files be swapped in
+        for staged, swapfile in swap.items():
+            os.replace(staged, swapfile)
+        return None
+
+    def Write(self, entry):
+        import json
+        with open(self.path, "a") as journal:
+            journal.write(json.dumps(entry) + "\n")
+            journal.flush()
+            os.fsync(journal.fileno())
+        return None
+
+def OpenJournal(settings):
+    """Returns the Journal given in the settings, opening it first
+    if it is just a path, or one which does nothing if there isn't one"""
+    journal = settings.get("journal")
+    return journal if isinstance(journal, Journal) else Journal(journal)
+
 def Concatenate(filedata,settings):
     """Writes raw output to a single file from a list or generator
     yielding raw decoded files, result is just a concatenation
         
     Expects to be given an iterable giving dictionaries
     with a filename and raw bytes filedata"""
+    journal = OpenJournal(settings)
+    journal.Recover(settings["outfile"])
     with open(settings["outfile"], "a+b") as output:
         # Iterates through generator which will fetch and decode each item
         for file in filedata:
+            if file in journal:
+                print(f"Skipping file '{file[b'filename']}', already written")
+                continue
             print(f"Processing file '{file[b'filename']}'")
             output.write(file["bytedata"])    # Actually writes the data
+            journal.Commit([file], output)
     return None
 
 def MetOfficeWeather(filedata,settings):
@@ -35,12 +285,6 @@ def MetOfficeWeather(filedata,settings):
     
     Expects to be given an iterable giving dictionaries
     with a filename and raw bytes filedata"""
-    import csv
-    import re
-    from datetime import datetime
-    from operator import itemgetter
-    # Precompile regex to capture text before line ends
-    regexsplitlines = re.compile(b'^(.+?)(?:\r\n|\r|\n|$)+', flags=re.MULTILINE)
     # Establish from the headers what is wanted.
     # Explicitly empty header coloumns are discarded.
     headers = settings["headers"].split(",")
@@ -51,6 +295,8 @@ def MetOfficeWeather(filedata,settings):
         if item[1] != "":
             itemlist.append(item[0])
             headings.append(item[1])
+    journal = OpenJournal(settings)
+    journal.Recover(settings["outfile"])
     with open(settings["outfile"], "a+", newline="") as output:
         NeedHeaders = not(output.tell()) # in append mode, tell==0 if new file
         # Create the Output CSV File
@@ -61,17 +307,17 @@ def MetOfficeWeather(filedata,settings):
             csvout.writerow(headings)
         r=0
         for file in filedata:
+            if file in journal:
+                print(f"Skipping file '{file[b'filename']}', already written")
+                continue
             try:
                 print(f"Processing file '{file[b'filename']}'")
-                # Take the raw file which is just bytes,
-                # chop it into lines and feed that into csv module.
-                # regex finditer is more memory efficient than str.splitlines()
-                # which does not scale to large file sizes.
-                csvinput = csv.reader(
-                    m.group(1).decode() for m in regexsplitlines.finditer(
-                        file["bytedata"],
-                    )
-                )
+                # Rows are gathered for the whole file and only written
+                # once it has all been read, so a bad file writes nothing
+                chunk = io.StringIO(newline="")
+                csvchunk = csv.writer(chunk, dialect="excel")
+                c=0
+                csvinput = SplitLines(file["bytedata"])
                 for line in csvinput:
                     # Look for the phrase followed by Date on the next line
                     if (line[0] == "Hourly Summary Data"
@@ -82,6 +328,9 @@ def MetOfficeWeather(filedata,settings):
                 # Reset totals
                 prevtotal = { i:0 for i in totals}
                 for line in csvinput:
+                    # All numbers are converted in one go, or left blank,
+                    # keeping the coloumn numbers but not the timestamp
+                    nums = [None, None] + ConvertNums(line[2:])
                     # Store all the values which are marked as totals
                     # As long as they arent blank, subtract the previous
                     # total from the current total and store this difference
@@ -89,22 +338,23 @@ def MetOfficeWeather(filedata,settings):
                     # Then carry over the original totals.
                     temptotals = {}
                     for i in totals:
-                        temptotals[i] = ConvertNum(line[i])
+                        temptotals[i] = nums[i]
                         if None not in (temptotals[i], prevtotal[i]):
-                            line[i] = temptotals[i] - prevtotal[i]
+                            nums[i] = temptotals[i] - prevtotal[i]
                     prevtotal = temptotals
                     # Assumes dates are valid %d/%m/%Y,%H%M and will become
                     # %d/%m/%Y %H:%M with leading zeros inserted if missing.
-                    # All numbers are converted or left blank
-                    # but only the requested coloumns are chosen
+                    # Only the requested coloumns are chosen
                     # and the timestamp coloumns skipped
-                    csvout.writerow(
+                    csvchunk.writerow(
                         [datetime.strptime(
                             " ".join(line[:2]), "%d/%m/%Y %H%M"
                                 ).strftime("%d/%m/%Y %H:%M")]
-                        + [ConvertNum(item) for item in itemgetter(
-                            *itemlist[1:])(line)])
-                    r+=1
+                        + [nums[i] for i in itemlist[1:]])
+                    c+=1
+                output.write(chunk.getvalue())
+                journal.Commit([file], output)
+                r+=c
                 print(f"{r} unique rows written so far")
             except Exception as e:
                 print(f"""Encountered some issue with '{file[b"filename"]}',
@@ -122,13 +372,14 @@ def Bablake(filedata,settings):
     
     The Regex for the filename definition
     must label the month and year parts"""
-    import csv
-    from datetime import datetime, timedelta
+    # xlrd is only needed here so only import it when used
     from xlrd import open_workbook
     headers = settings["headers"].split(",")
     ncols = len(headers)+2
     r=0
     seen = set()
+    journal = OpenJournal(settings)
+    journal.Recover(settings["outfile"])
     with open(settings["outfile"], "a+", newline="") as output:
         NeedHeaders = not(output.tell()) # in append mode, tell==0 if new file
         # Create the Output CSV File
@@ -138,9 +389,17 @@ def Bablake(filedata,settings):
         if NeedHeaders:
             csvout.writerow(headers)
         for file in filedata:
+            if file in journal:
+                print(f"Skipping file '{file[b'filename']}', already written")
+                continue
             try:
                 filename = file[b"filename"]
                 print(f"Processing file '{filename}'")
+                # Rows are gathered for the whole file and only written
+                # once it has all been read, so a bad file writes nothing
+                chunk = io.StringIO(newline="")
+                csvchunk = csv.writer(chunk, dialect="excel")
+                chunkseen = set()
                 wb = open_workbook(
                     filename=filename,
                     file_contents=file["bytedata"],
@@ -169,9 +428,10 @@ def Bablake(filedata,settings):
                     rowvals = s.row_values(row)
                     # Only proceed if we havent seen this line before and
                     # for "1" data, anything else is averages/totals etc.
-                    if rowvals[0] == 1 and tuple(rowvals) not in seen:
+                    if (rowvals[0] == 1 and tuple(rowvals) not in seen
+                        and tuple(rowvals) not in chunkseen):
                         # Keep track of what's been seen
-                        seen.add(tuple(rowvals))
+                        chunkseen.add(tuple(rowvals))
                         # No of days and hours rom new year
                         offset = timedelta(
                             days = (rowvals[1])-1,
@@ -188,11 +448,14 @@ def Bablake(filedata,settings):
                             # data is actually for the next year
                             dt.replace(year=baseyear.year+1)
                         # Dump it to the file
-                        csvout.writerow(
+                        csvchunk.writerow(
                             [dt.strftime("%d/%m/%Y %H:%M")]
                             + s.row_values(row,3,ncols)
                         )
-                        r+=1
+                output.write(chunk.getvalue())
+                journal.Commit([file], output)
+                seen |= chunkseen
+                r+=len(chunkseen)
                 print(f"{r} unique rows written so far")
             except Exception as e:
                 print(f"""Encountered some issue with '{file[b"filename"]}', but {r} rows written so far.
@@ -211,25 +474,28 @@ def MeterOnline(filedata,settings):
 
     Expects to be given an iterable giving dictionaries
     with a filename and raw bytes filedata"""
-    import csv
-    import re
-    from datetime import datetime, timedelta
-    # Precompile regex to capture text before line ends
-    regexsplitlines = re.compile(b'^(.+?)(?:\r\n|\r|\n|$)+', flags=re.MULTILINE)
+    journal = OpenJournal(settings)
+    journal.Recover(settings["outfile"])
     meterdata = {}
+    # Start with anything read by a run which died before writing it out
+    for data in journal.pending.values():
+        for meter, readings in data.items():
+            meterdata.setdefault(meter, {}).update(
+                (datetime.fromisoformat(ts), value) for ts, value in readings
+            )
+    done = []
     r=0
     for file in filedata:
+        if file in journal:
+            print(f"Skipping file '{file[b'filename']}', already written")
+            continue
         try:
             print(f"Processing file '{file[b'filename']}'")
-            # Take the raw file which is just bytes,
-            # chop it into lines and feed that into csv module.
-            # regex finditer is more memory efficient than str.splitlines()
-            # which does not scale to large file sizes.
-            csvinput = csv.reader(
-                m.group(1).decode() for m in regexsplitlines.finditer(
-                    file["bytedata"],
-                )
-            )
+            # Readings are only kept once the whole file has been read
+            # so a bad file adds nothing
+            filemeterdata = {}
+            c=0
+            csvinput = SplitLines(file["bytedata"])
             for line in csvinput:
                 # 0th coloumn is a friendly name which will be ignored
                 # 1st coloumn is the serial number which is used in the header
@@ -243,10 +509,18 @@ def MeterOnline(filedata,settings):
                 # The first value (4th coloumn) is assumed to be for the period starting at midnight
                 # Add 30 minutes for each subsequent coloumn
                 try:
-                    meterdata[line[1]] |= { date+t*timedelta(minutes=30) : ConvertNum(r) for t,r in enumerate(line[4:]) }
+                    filemeterdata[line[1]] |= { date+t*timedelta(minutes=30) : r for t,r in enumerate(ConvertNums(line[4:])) }
                 except KeyError:
-                    meterdata[line[1]] = { date+t*timedelta(minutes=30) : ConvertNum(r) for t,r in enumerate(line[4:]) }
-                r+=1
+                    filemeterdata[line[1]] = { date+t*timedelta(minutes=30) : r for t,r in enumerate(ConvertNums(line[4:])) }
+                c+=1
+            for meter in filemeterdata:
+                meterdata.setdefault(meter, {}).update(filemeterdata[meter])
+            journal.Checkpoint(file, {
+                meter: [[ts.isoformat(), value] for ts, value in readings.items()]
+                for meter, readings in filemeterdata.items()
+            })
+            done.append(file)
+            r+=c
             print(f"{r} unique rows read so far")
         except Exception as e:
             print(f"""Encountered some issue with '{file[b"filename"]}',
@@ -270,6 +544,7 @@ Error: {e}""")
                 **{ meter : meterdata[meter].get(timestamp) for meter in meterdata },
             } )
             w+=1
+        journal.Commit(done, output)
     print(f"Finished. {r} row read, {w} rows written\n")
     return None
 
@@ -284,9 +559,6 @@ def MeterOnlineCalibrated(filedata,settings):
 
     Expects to be given an iterable giving dictionaries
     with a filename and raw bytes filedata"""
-    import csv
-    import re
-    from datetime import datetime, timedelta
     def calibrate(completedata, perioddata, knowntotals):
         for ts,periodValue in sorted(perioddata.items()):  # ts is datetime, periodValue was provided
             if ts in knowntotals:  # check if we already know a totalValue for this timestamp
@@ -312,54 +584,70 @@ def MeterOnlineCalibrated(filedata,settings):
         for ts,reads in perioddata.items():
             completedata[ts] = (reads,None) # Just for padding things out but may get overritten next time
         return completedata, perioddata, knowntotals
-    # Precompile regex to capture text before line ends
-    regexsplitlines = re.compile(b'^(.+?)(?:\r\n|\r|\n|$)+', flags=re.MULTILINE)
+    journal = OpenJournal(settings)
+    outfiles = [outfile for outfile in (settings.get("sigmaoutfile"), settings.get("dcsoutfile")) if outfile]
+    # The storage file is rewritten each time so is swapped in with the commit
+    newstoragefile = settings.get("storagefile", "MeterOnlineCalibrated.csv")
+    journal.Recover(*outfiles, swapfiles=(newstoragefile,))
     perioddata, knowntotals, completedata = {}, {}, {}
     if (storagefile := settings.get("storagefile")):
         t,p,c = 0,0,0
         try:
             with open(storagefile, newline='') as unmatchedfile:
-                unmatchedcsv = csv.reader(unmatchedfile)
-                for reads in unmatchedcsv:
-                    # Should be in the format of [ 0:meterid, 1:timestamp, 2:periodValue, 3:totalValue, 4:Real ]
+                unmatchedcsv = list(csv.reader(unmatchedfile))
+                # Should be in the format of [ 0:meterid, 1:timestamp, 2:periodValue, 3:totalValue, 4:Real ]
+                # Convert the periodValue and totalValue coloumns in one go each
+                periodValues = ConvertNums([reads[2] for reads in unmatchedcsv])
+                totalValues = ConvertNums([reads[3] for reads in unmatchedcsv])
+                for reads, periodValue, totalValue in zip(unmatchedcsv, periodValues, totalValues):
                     meter = reads[0]
                     ts = datetime.fromisoformat(reads[1])
                     if reads[2] == "":  # No period data given so this must be a total value
                         try:
-                            knowntotals[meter] |= { ts : (ConvertNum(reads[3]), reads[4].lower() == "true") }
+                            knowntotals[meter] |= { ts : (totalValue, reads[4].lower() == "true") }
                         except KeyError:
-                            knowntotals[meter] = { ts : (ConvertNum(reads[3]), reads[4].lower() == "true") }
+                            knowntotals[meter] = { ts : (totalValue, reads[4].lower() == "true") }
                         t+=1
                     elif reads[3] == "": # No total data given so this must be a period data
                         try:
-                            perioddata[meter] |= { ts : ConvertNum(reads[2]) }
+                            perioddata[meter] |= { ts : periodValue }
                         except KeyError:
-                            perioddata[meter] = { ts : ConvertNum(reads[2]) }
+                            perioddata[meter] = { ts : periodValue }
                         p+=1
                     elif "" not in (reads[2],reads[3]) and reads[4] == "": # Fully populated is completed data
                         try:
-                            completedata[meter] |= { ts : (ConvertNum(reads[2]) ,ConvertNum(reads[3])) }
+                            completedata[meter] |= { ts : (periodValue, totalValue) }
                         except KeyError:
-                            completedata[meter] = { ts : (ConvertNum(reads[2]) ,ConvertNum(reads[3])) }
+                            completedata[meter] = { ts : (periodValue, totalValue) }
                         c+=1
                     else:
                         print(f"Something wrong with this line: {reads}")
         except FileNotFoundError:
             print(f"Storage file not found: '{storagefile}'")
         print(f"Storage file loaded with {t} totaliser reads, {p} periodic reads, and {c} already complete readings")
+    # Add anything read by a run which died before writing it out
+    for data in journal.pending.values():
+        for meter, readings in data["totals"].items():
+            knowntotals.setdefault(meter, {}).update(
+                (datetime.fromisoformat(ts), (total, real)) for ts, total, real in readings
+            )
+        for meter, readings in data["periods"].items():
+            perioddata.setdefault(meter, {}).update(
+                (datetime.fromisoformat(ts), value) for ts, value in readings
+            )
+    done = []
     r=0
     for file in filedata:
+        if file in journal:
+            print(f"Skipping file '{file[b'filename']}', already written")
+            continue
         try:
             print(f"Processing file '{file[b'filename']}'")
-            # Take the raw file which is just bytes,
-            # chop it into lines and feed that into csv module.
-            # regex finditer is more memory efficient than str.splitlines()
-            # which does not scale to large file sizes.
-            csvinput = csv.reader(
-                m.group(1).decode() for m in regexsplitlines.finditer(
-                    file["bytedata"],
-                )
-            )
+            # Readings are only kept once the whole file has been read
+            # so a bad file adds nothing
+            fileknowntotals, fileperioddata = {}, {}
+            c=0
+            csvinput = SplitLines(file["bytedata"])
             for line in csvinput:
                 # 0th coloumn is a friendly name which will be ignored
                 # 1st coloumn is the serial number which is used in the header
@@ -379,15 +667,32 @@ def MeterOnlineCalibrated(filedata,settings):
                     timestamp = timestamp.replace(minute=30, second=0, microsecond=0) + timedelta(hours=1)
                 # It will be snapped to the day before for the HH data
                 date = (timestamp.replace(hour=0, minute=0, second=0, microsecond=0) - timedelta(days=1))
+                # Convert the totalised reading and HH data in one go
+                total, *periods = ConvertNums(line[3:])
                 # The first value (4th coloumn) is assumed to be for the period starting at midnight
                 # Add 30 minutes for each subsequent coloumn
                 try:
-                    knowntotals[line[1]] |= { timestamp : (ConvertNum(line[3]), True) }
-                    perioddata[line[1]] |= { date+t*timedelta(minutes=30) : ConvertNum(r) for t,r in enumerate(line[4:]) }
+                    fileknowntotals[line[1]] |= { timestamp : (total, True) }
+                    fileperioddata[line[1]] |= { date+t*timedelta(minutes=30) : r for t,r in enumerate(periods) }
                 except KeyError:
-                    knowntotals[line[1]] = { timestamp : (ConvertNum(line[3]), True) }
-                    perioddata[line[1]] = { date+t*timedelta(minutes=30) : ConvertNum(r) for t,r in enumerate(line[4:]) }
-                r+=1
+                    fileknowntotals[line[1]] = { timestamp : (total, True) }
+                    fileperioddata[line[1]] = { date+t*timedelta(minutes=30) : r for t,r in enumerate(periods) }
+                c+=1
+            for meter in fileknowntotals:
+                knowntotals.setdefault(meter, {}).update(fileknowntotals[meter])
+                perioddata.setdefault(meter, {}).update(fileperioddata[meter])
+            journal.Checkpoint(file, {
+                "totals": {
+                    meter: [[ts.isoformat(), *reads] for ts, reads in readings.items()]
+                    for meter, readings in fileknowntotals.items()
+                },
+                "periods": {
+                    meter: [[ts.isoformat(), value] for ts, value in readings.items()]
+                    for meter, readings in fileperioddata.items()
+                },
+            })
+            done.append(file)
+            r+=c
             print(f"{r} unique rows read so far")
         except Exception as e:
             print(f"""Encountered some issue with '{file[b"filename"]}',
@@ -428,7 +733,10 @@ Error: {e}""")
                     _ = outputcsv.writerow([meter, ts.strftime(r"%d/%m/%Y"), ts.strftime(r"%H:%M:%S"), 30, reads[0] or 0, reads[1] or 0]) # swap None for zeros
                     w+=1
         print(f"Finished DCS File. {w} rows written\n")
-    with open(settings.get("storagefile", "MeterOnlineCalibrated.csv"), "w", newline='') as unmatchedfile:
+    # Write the storage file under a staging name and only swap it in
+    # along with the commit, so it always matches the outfiles
+    staged = journal.Staging(newstoragefile)
+    with open(staged, "w", newline='') as unmatchedfile:
         unmatchedcsv = csv.writer(unmatchedfile)
         t,p = 0,0
         for meter in knowntotals:
@@ -439,22 +747,80 @@ Error: {e}""")
             for ts,reads in sorted(perioddata[meter].items()): # Output in datetime order
                 _ = unmatchedcsv.writerow([meter, ts.isoformat(sep=" "), reads, None, None])
                 p+=1
+    journal.Commit(done, *outfiles, swap={staged:newstoragefile})
     print(f"Storage file now contains {t} unmatched total readings and {p} unmatched periodic reads\n")
     return None
 
-def Shelve(filedata,settings):
-    """Writes raw output to a shelve file
-        
+def Archive(filedata,settings):
+    """Writes raw attachments to an append only archive so they can be
+    replayed into any converter later without the IMAP server
+
+    The outfile is treated as a directory containing content addressed
+    blobs (named by their sha256) and an index.csv listing the sha256,
+    filename, folder, uidvalidity, uid, part, size and date of every
+    attachment. Identical content is only stored once and attachments
+    already in the index are not added again, UIDs only being unique
+    within one folder and UIDVALIDITY. See Files.ArchiveGenerator to replay.
+
     Expects to be given an iterable giving dictionaries
     with a filename and raw bytes filedata"""
-    import shelve
-    # Open shelf read/write or create
-    myshelf=shelve.open(settings["outfile"],"c")
-    myshelf["settings"] = settings
-    myshelf["filedata"] = []
-    for file in filedata:
-        # regex match object can't be shelved so delete it
-        del file[b"regexmatch"]
-        myshelf["filedata"] += file
-    myshelf.close()
+    import hashlib
+    archive = settings["outfile"]
+    os.makedirs(os.path.join(archive, "blobs"), exist_ok=True)
+    indexfile = os.path.join(archive, "index.csv")
+    # Read the index once so attachments seen on previous runs are skipped
+    journal = OpenJournal(settings)
+    journal.Recover(indexfile)
+    # The index is all there is to find the blobs by, so even without
+    # a journal never append onto half a row left by a crash
+    TruncatePartialLine(indexfile)
+    seen = set()
+    try:
+        with open(indexfile, newline="") as index:
+            for entry in csv.DictReader(index):
+                seen.add((entry["folder"], entry["uidvalidity"], entry["uid"], entry["part"], entry["sha256"]))
+    except FileNotFoundError:
+        pass
+    a, b = 0, 0
+    with open(indexfile, "a+", newline="") as index:
+        csvout = csv.writer(index, dialect="excel")
+        if not(index.tell()): # in append mode, tell==0 if new file
+            csvout.writerow(["sha256", "filename", "folder", "uidvalidity", "uid", "part", "size", "date"])
+        for file in filedata:
+            if file in journal:
+                print(f"Skipping file '{file[b'filename']}', already written")
+                continue
+            print(f"Processing file '{file[b'filename']}'")
+            digest = hashlib.sha256(file["bytedata"]).hexdigest()
+            # Blank for files which didn't come from an email
+            key = tuple(
+                str(file.get(field) or "") for field in (b"folder", b"uidvalidity", b"uid", b"part")
+            ) + (digest,)
+            if key in seen:
+                print(f"Already archived as {digest}")
+                journal.Commit([file], index)
+                continue
+            # Blobs are spread over subdirectories by the first 2 characters
+            blobpath = os.path.join(archive, "blobs", digest[:2], digest)
+            if not os.path.exists(blobpath):
+                os.makedirs(os.path.dirname(blobpath), exist_ok=True)
+                # Write to a temporary name first so a partial blob is never
+                # mistaken for a complete one
+                with open(blobpath + ".tmp", "wb") as blob:
+                    blob.write(file["bytedata"])
+                os.replace(blobpath + ".tmp", blobpath)
+                b+=1
+            # The email date, left blank for files which didn't come from an email
+            date = file.get(b"date")
+            csvout.writerow([
+                digest,
+                file[b"filename"],
+                *key[:4],
+                len(file["bytedata"]),
+                date.isoformat(sep=" ", timespec="seconds") if date else "",
+            ])
+            journal.Commit([file], index)
+            seen.add(key)
+            a+=1
+    print(f"Finished. {a} attachments archived, {b} new blobs stored\n")
     return None
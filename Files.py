@@ -1,7 +1,10 @@
+import bisect
+import csv
 import glob
 import os.path
 import mmap
 import re
+from datetime import datetime
 
 infiles = r"E:\GitHub\MailMiner\Sample Inputs\Wellesbourne Weather\MMS_Daily_Wellesbourne_20160928.csv"
 
@@ -14,3 +17,73 @@ def FileGenerator(infiles,regex):
                 with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as bytedata:
                     yield {b"filename":filename, "bytedata":bytedata, b"regexmatch":regexmatch}
 
+
+def ArchiveIndex(archive):
+    """Returns the index of an archive written by Converters.Archive
+    as a list of dicts sorted by date, with any undated entries first,
+    and a dict of the same entries listed by filename.
+    Rows which can't be read are reported and left out"""
+    index, byfilename = [], {}
+    indexpath = os.path.join(archive, "index.csv")
+    with open(indexpath, newline="") as indexfile:
+        rows = csv.DictReader(indexfile)
+        for entry in rows:
+            try:
+                if not re.fullmatch("[0-9a-f]{64}", entry["sha256"]):
+                    raise ValueError(f"not a sha256: {entry['sha256']!r}")
+                entry["size"] = int(entry["size"])
+                # Files which didn't come from an email have no folder, uid or date
+                entry["folder"] = entry.get("folder") or None
+                entry["uidvalidity"] = int(entry["uidvalidity"]) if entry.get("uidvalidity") else None
+                entry["uid"] = int(entry["uid"]) if entry["uid"] else None
+                entry["part"] = entry["part"] or None
+                entry["date"] = datetime.fromisoformat(entry["date"]) if entry["date"] else None
+            except (ValueError, TypeError) as e:
+                # TypeError if the row was cut short
+                print(f"Skipping bad row on line {rows.line_num} of '{indexpath}': {e}")
+                continue
+            index.append(entry)
+    index.sort(key=lambda entry: (entry["date"] is not None, entry["date"] or datetime.min))
+    for entry in index:
+        byfilename.setdefault(entry["filename"], []).append(entry)
+    return index, byfilename
+
+def ArchiveGenerator(archive,regex,filename=None,start=None,end=None,index=None):
+    """Replays attachments from an archive written by Converters.Archive
+    in date order, optionally only those with the given filename
+    or with a date from start (inclusive) up to end (exclusive).
+    Undated entries are left out when a start or end is given.
+
+    Pass index from ArchiveIndex to avoid reading it again each call"""
+    index, byfilename = index or ArchiveIndex(archive)
+    # Looking up a filename goes straight to its entries
+    entries = index if filename is None else byfilename.get(filename, [])
+    if start is not None or end is not None:
+        entries = [entry for entry in entries if entry["date"] is not None]
+        dates = [entry["date"] for entry in entries]
+        lo = 0 if start is None else bisect.bisect_left(dates, start)
+        hi = len(entries) if end is None else bisect.bisect_left(dates, end)
+        entries = entries[lo:hi]
+    for entry in entries:
+        regexmatch = regex.fullmatch(entry["filename"])
+        if regexmatch:
+            digest = entry["sha256"]
+            with open(os.path.join(archive, "blobs", digest[:2], digest), "rb") as file:
+                # mmap can't map an empty file
+                if entry["size"] == 0:
+                    bytedata = b""
+                else:
+                    bytedata = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+                # The same keys as FindAttachments so a journal recognises them
+                yield {
+                    b"filename":entry["filename"],
+                    "bytedata":bytedata,
+                    b"regexmatch":regexmatch,
+                    b"folder":entry["folder"],
+                    b"uidvalidity":entry["uidvalidity"],
+                    b"uid":entry["uid"],
+                    b"part":entry["part"],
+                    b"date":entry["date"],
+                }
+                if bytedata:
+                    bytedata.close()
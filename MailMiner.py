@@ -95,11 +95,11 @@ def FindAttachments(server,settings):
     # Prepare to create a dictionary
     filedetails={}
     # Drop readonly to allow things to be flagged as Seen
-    server.select_folder(settings["folder"], readonly=settings["readonly"])
+    folderinfo = server.select_folder(settings["folder"], readonly=settings["readonly"])
     # Eventually, search for emails matching the various criteria
     msguids = server.search(settings["search"])
-    # Get structure without downloading message
-    allmsgstructs = server.fetch(msguids, ["BODYSTRUCTURE"])
+    # Get structure and received date without downloading message
+    allmsgstructs = server.fetch(msguids, ["BODYSTRUCTURE", "INTERNALDATE"])
     for uid in msguids:
         msgstruct = allmsgstructs[uid]
         if (b"BODYSTRUCTURE" in msgstruct):
@@ -124,6 +124,10 @@ def FindAttachments(server,settings):
                             b"encoding":part["encoding"],
                             b"textsize":part["size"],
                             b"part":p,
+                            b"date":msgstruct.get(b"INTERNALDATE"),
+                            # UIDs are only permanent within one UIDVALIDITY
+                            b"folder":settings["folder"],
+                            b"uidvalidity":folderinfo.get(b"UIDVALIDITY"),
                         }
                     )
                     # If encoding is correct and filename matches the regex
@@ -157,7 +161,7 @@ def FetchAttachments(server,filedetails,filedata=None):
         batch.update(
             server.fetch(
                 byparts[part],
-                [f"BODY[{part}]".encode()],
+                [f"BODY.PEEK[{part}]".encode()],
             )
         )
         print("Batch downloaded")
@@ -178,10 +182,11 @@ def FetchAttachments(server,filedetails,filedata=None):
 def FetchDecode(server,detail):
     """Fetches an email attachment and returned the decoded contents"""
     print(f"Downloading email ID: {detail[b'uid']}, part: {detail[b'part']}")
-    # Fetches and decodes payload immediately
+    # Fetches and decodes payload immediately, PEEK so that it is
+    # only flagged as Seen once it has actually been converted
     data = server.fetch(
             detail[b"uid"],
-            [f"BODY[{detail[b'part']}]".encode()],
+            [f"BODY.PEEK[{detail[b'part']}]".encode()],
         )[detail[b"uid"]][f"BODY[{detail[b'part']}]".encode()]
     if detail[b"encoding"] == b"base64":
         data = base64.b64decode(data)
@@ -189,12 +194,188 @@ def FetchDecode(server,detail):
     print(f"Attachment: '{detail[b'filename']}', {len(data)} bytes.")
     return data
 
-if __name__ == "__main__":
-    import configparser
+def Connect(app,imapserver,username,scopes):
+    """Logs in to the IMAP server with an OAuth2 token from the
+    MSAL app, which reuses its cached token until close to expiry.
+    Returns the server and the monotonic time the token expires"""
     import imaplib
-    import Converters # Secondary Library where Converters functinos are defined
+    import time
     from imapclient import IMAPClient
+    token = app.acquire_token_for_client(scopes=scopes)
+    if "access_token" not in token:
+        raise ConnectionError(f"Could not get a token: {token.get('error_description')}")
+    expiry = time.monotonic() + token["expires_in"]
+    # Use UIDs so numbers are permanent
+    server = IMAPClient(imapserver, use_uid=True)
+    # Standard TLS version doesnt work so make the connection by hand
+    server._imap = imaplib.IMAP4_SSL(host=imapserver)
+    # Actually login and print the output while at it
+    print(server.oauth2_login(username, token["access_token"], mech='XOAUTH2')[0].decode())
+    return server, expiry
+
+
+def TaskFolder(config,section):
+    """Subfolder of INBOX, i.e. folder = "INBOX/Siemens Energy" """
+    return "INBOX/" + config.get(section,"folder",fallback="")
+
+
+def TokenApp(clientid,authority,password):
+    """Creates the MSAL app which holds the token cache,
+    msal is slow to import so it is only imported here"""
     from msal import ConfidentialClientApplication
+    return ConfidentialClientApplication(
+        client_id = clientid, authority = authority, client_credential = password
+        )
+
+
+def TaskConverter(config,section):
+    """Returns the converter function named for a task,
+    only importing Converters once a task has mail to convert"""
+    import Converters # Secondary Library where Converters functinos are defined
+    return getattr(Converters,
+        config.get(
+            section,
+            "converter",
+            fallback="Archive",
+        )
+    )
+
+
+def RunTask(server,config,section):
+    """Finds, fetches and converts all the attachments for one task"""
+    settings = dict(config.items(section))
+    settings["folder"] = TaskFolder(config,section)
+    # Treat the folder as readonly so nothing gets marked as read/seen
+    settings["readonly"] = config.getboolean(
+        section,"readonly",fallback=True,
+    )
+    # Split words by spaces into a list, i.e. searchcriteria = ["ALL"]
+    settings["search"] = config.get(
+        section,"search",fallback="ALL",
+    ).split(" ")
+    if "filename" not in settings or settings["filename"] == "":
+        print(
+            """There was no "filename" option given, or it was empty.
+A regex was expected. This section will be skipped"""
+        )
+        return None
+    # Convert regex string to bytes
+    # i.e. regex = re.compile(rb"UVW_[0-9]{6}_to_[0-9]{6}_produced_at_[0-9]{6}\.csv")
+    settings["regex"] = re.compile(settings["filename"])
+    # The output file name, or directory for an Archive
+    settings["outfile"] = config.get(
+        section,"outfile",
+        fallback="archive" if config.get(section,"converter",fallback="Archive") == "Archive" else "output.csv",
+    )
+    print(
+        f"""Section: "{section}"
+    Folder: "{settings["folder"]}"
+    Read Only: "{settings["readonly"]}"
+    Criteria: "{settings["search"]}"
+    Regex: "{settings["filename"]}"
+    outfile: "{settings["outfile"]}"
+    """
+    )
+    # Get all the attachment details
+    founddetails = FindAttachments(server,settings)
+    print(f"Found {len(founddetails)} attachments")
+    if not founddetails:
+        # Nothing to do so don't pay for importing the converters
+        return None
+    # Leave out anything a previous run already wrote so it carries
+    # on where it stopped rather than starting again from scratch
+    from Converters import OpenJournal
+    settings["journal"] = journal = OpenJournal(settings)
+    filedetails = {
+        uid:parts for uid,msg in founddetails.items()
+        if (parts := {p:part for p,part in msg.items() if part not in journal})
+    }
+    if len(filedetails) < len(founddetails):
+        print(f"{len(founddetails) - len(filedetails)} already written by a previous run")
+    # Generator Expression where each element is a copy of
+    # the original filedetails dictionary along with the
+    # bytedata after fetching, downloading and decoding it
+    # Also run if a previous run died with files read but not written out
+    if len(filedetails) > 0 or journal.pending:
+        filedata = (
+            {
+                "bytedata":FetchDecode(server,part),
+                **part,
+            } for msg in filedetails.values() for part in msg.values()
+        )
+        try:
+            converter = TaskConverter(config,section)
+        except AttributeError as e:
+            print(f"Error with the converter for this section, it will be skipped. {e}")
+            return None
+        # Runs the named function directly from the Converters library
+        converter(filedata,settings)
+    if not settings["readonly"]:
+        # With a journal, only emails with every part written are Seen
+        seen = [
+            uid for uid,msg in founddetails.items() if not journal.path
+            or all(part in journal for part in msg.values())
+        ]
+        if seen:
+            server.add_flags(seen, [br"\Seen"])
+    return None
+
+
+def Watch(connect,config,folder,sections,idletimeout=600,refreshmargin=120,maxbackoff=300):
+    """Keeps a connection open on one folder and runs the sections
+    which use it whenever new mail arrives, using IMAP IDLE.
+    The connection is remade with a fresh token shortly before the
+    current one expires, and after any error with exponential backoff"""
+    import time
+    backoff = 1
+    while True:
+        server = None
+        try:
+            server, expiry = connect()
+            if expiry - refreshmargin <= time.monotonic():
+                # Otherwise this would reconnect straight away, over and over
+                raise ValueError(f"Token only has {expiry - time.monotonic():.0f} seconds left, within the refreshmargin of {refreshmargin} seconds")
+            backoff = 1
+            # None so it catches up on anything which arrived while disconnected
+            lastexists = None
+            while (remaining := expiry - refreshmargin - time.monotonic()) > 0:
+                # RunTask leaves the folder selected, but make sure of it.
+                # Mail arriving while the tasks run is announced while
+                # imapclient isn't listening, so compare the message count
+                exists = server.select_folder(folder, readonly=True)[b"EXISTS"]
+                if lastexists is None or exists > lastexists:
+                    if lastexists is not None:
+                        print(f"New mail in '{folder}'")
+                    lastexists = exists
+                    for section in sections:
+                        RunTask(server,config,section)
+                    continue
+                lastexists = exists
+                server.idle()
+                # Servers may drop an IDLE after 30 minutes, so restart it regularly
+                responses = server.idle_check(timeout=min(idletimeout, remaining))
+                server.idle_done()
+                if any(b"EXISTS" in response for response in responses):
+                    # Run even if the count didn't go up as mail may also have been removed
+                    lastexists = -1
+            print(f"Token for '{folder}' close to expiry, reconnecting")
+        except Exception as e:
+            print(f"""Encountered some issue watching '{folder}',
+retrying in {backoff} seconds.
+Error: {e}""")
+            time.sleep(backoff)
+            backoff = min(backoff*2, maxbackoff)
+        finally:
+            if server is not None:
+                try:
+                    print(server.logout().decode())
+                except Exception:
+                    pass
+
+
+if __name__ == "__main__":
+    import configparser
+    import threading
     serverconf, config = configparser.ConfigParser(), configparser.ConfigParser()
     serverconf.read(r"server.cfg")
     config.read(r"config.cfg")
@@ -217,79 +398,54 @@ if __name__ == "__main__":
 Check the "Settings" section contains the "server", "clientid",
 "tenantid", "username", "password", and "tasks" options"""
         )
+        raise SystemExit(1)
     
-    app = ConfidentialClientApplication(
-        client_id = clientid, authority = authority, client_credential = password
-        )
+    # The app holds the token cache so keep it for the whole run
+    app = TokenApp(clientid,authority,password)
     
-    token = app.acquire_token_for_client(scopes=scopes)
-    # Use UIDs so numbers are permanent
-    server = IMAPClient(imapserver, use_uid=True)
-    # Standard TLS version doesnt work so make the connection by hand
-    server._imap = imaplib.IMAP4_SSL(host=imapserver)
-    # Actually login and print the output while at it
-    print(server.oauth2_login(username, token["access_token"], mech='XOAUTH2')[0].decode())
-
-    for section in tasks:
-        settings = dict(config.items(section))
-        # Subfolder of INBOX, i.e. folder = "INBOX/Siemens Energy"
-        settings["folder"] = "INBOX/" + config.get(
-            section,"folder",fallback="",
-        )
-        # Treat the folder as readonly so nothing gets marked as read/seen
-        settings["readonly"] = config.getboolean(
-            section,"readonly",fallback=True,
-        )
-        # Split words by spaces into a list, i.e. searchcriteria = ["ALL"]
-        settings["search"] = config.get(
-            section,"search",fallback="ALL",
-        ).split(" ")
-        # Convert regex string to bytes
-        # i.e. regex = re.compile(rb"UVW_[0-9]{6}_to_[0-9]{6}_produced_at_[0-9]{6}\.csv")
-        settings["regex"] = re.compile(
-            config.get(
-                section,"filename",fallback=None,
-            )
-        )
-        if "filename" not in settings or settings["filename"] == "":
-            print(
-                """There was no "filename" option given, or it was empty.
-A regex was expected. This section will be skipped"""
-            )
-            continue
-        # The output file name
-        settings["outfile"] = config.get(
-            section,"outfile",fallback="output.csv"
-        )
-        print(
-            f"""Section: "{section}"
-    Folder: "{settings["folder"]}"
-    Read Only: "{settings["readonly"]}"
-    Criteria: "{settings["search"]}"
-    Regex: "{settings["filename"]}"
-    outfile: "{settings["outfile"]}"
-    """
-        )
-        # Get all the attachment details
-        filedetails = FindAttachments(server,settings)
-        print(f"Found {len(filedetails)} attachments")
-        # Generator Expression where each element is a copy of
-        # the original filedetails dictionary along with the
-        # bytedata after fetching, downloading and decoding it
-        if len(filedetails) > 0:
-            filedata = (
-                {
-                    "bytedata":FetchDecode(server,part),
-                    **part,
-                } for msg in filedetails.values() for part in msg.values()
-            )
-            # Runs the named function directly from the local scope
-            getattr(Converters,
-                config.get(
-                    section,
-                    "converter",
-                    fallback="Shelve",
-                )
-            )(filedata,settings)
-    print(server.logout().decode())
-
+    def connect():
+        return Connect(app,imapserver,username,scopes)
+    
+    if serverconf.getboolean("Settings","watch",fallback=False):
+        # IDLE only watches the selected folder so each folder
+        # gets its own connection and thread
+        folders = {}
+        for section in tasks:
+            folders.setdefault(TaskFolder(config,section), []).append(section)
+        watchsettings = {
+            "idletimeout":serverconf.getint("Settings","idletimeout",fallback=600),
+            "refreshmargin":serverconf.getint("Settings","refreshmargin",fallback=120),
+            "maxbackoff":serverconf.getint("Settings","maxbackoff",fallback=300),
+        }
+        if min(watchsettings.values()) <= 0:
+            print("""Error with server settings in config file.
+"idletimeout", "refreshmargin" and "maxbackoff" must be more than 0""")
+            raise SystemExit(1)
+        # MSAL hands back its cached token until it has less than 5 minutes
+        # left, so reconnecting any earlier than that gets the same token
+        if watchsettings["refreshmargin"] >= 300:
+            print("""Error with server settings in config file.
+"refreshmargin" must be less than 300 seconds, as a new token
+is only given out once the old one has less than 5 minutes left""")
+            raise SystemExit(1)
+        threads = [
+            threading.Thread(
+                target=Watch,
+                args=(connect,config,folder,sections),
+                kwargs=watchsettings,
+                name=folder,
+                daemon=True,
+            ) for folder, sections in folders.items()
+        ]
+        for thread in threads:
+            thread.start()
+        try:
+            for thread in threads:
+                thread.join()
+        except KeyboardInterrupt:
+            print("Stopped watching")
+    else:
+        server, expiry = connect()
+        for section in tasks:
+            RunTask(server,config,section)
+        print(server.logout().decode())